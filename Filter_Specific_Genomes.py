@@ -1,20 +1,39 @@
 # Import information from assembly_summary_genbank.txt and download specific genome FASTA files
 import os
-import subprocess
+import argparse
 import logging
-import pandas as pd
-import shutil
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zlib
 from pathlib import Path
-import gzip
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
 
 # --------------------------- SETUP LOGGING ---------------------------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# --------------------------- HTTP SESSION ---------------------------
+# One pooled keep-alive session shared by all download threads
+MAX_WORKERS = 16
+CHUNK_SIZE = 1 << 22
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+SESSION.mount("http://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+# --------------------------- ASSEMBLY SUMMARY PARSING ---------------------------
+# Field values treated as missing ("na" is what NCBI uses for an absent ftp_path)
+NULL_VALUES = frozenset(["", "na", "NA", "N/A", "null", "NULL"])
+
 # --------------------------- LOAD ASSEMBLY SUMMARY ---------------------------
-def load_assembly_summary(file_path):
+def load_assembly_summary(file_path, wanted):
     """
-    Load assembly_summary_genbank.txt into a DataFrame.
+    Load assembly_summary_genbank.txt as a list of (assembly_accession, ftp_path) tuples.
     Handles lines starting with '#'.
+    Rows are filtered against the `wanted` set of accessions while streaming the file,
+    so only the matching assemblies are ever kept in memory.
+    Rows whose column count does not match the header, or whose ftp_path is one of
+    NULL_VALUES, are skipped.
     """
     # Read file manually to handle the header line
     with open(file_path, "r") as f:
@@ -25,112 +44,209 @@ def load_assembly_summary(file_path):
         else:
             raise ValueError("No header line found starting with '#assembly_accession'")
 
-    # Read the data using the correct header line
-    df = pd.read_csv(
-        file_path,
-        sep="\t",
-        comment="#",
-        names=header_line.split("\t"),
-        dtype=str,
-        low_memory=False
-    )
-
     # Strip any spaces in column names
-    df.columns = df.columns.str.strip()
+    columns = [name.strip() for name in header_line.split("\t")]
 
     # Verify required columns exist
-    if not {"assembly_accession", "ftp_path"}.issubset(df.columns):
-        raise KeyError(f"Expected columns not found. Found: {list(df.columns)}")
+    if not {"assembly_accession", "ftp_path"}.issubset(columns):
+        raise KeyError(f"Expected columns not found. Found: {columns}")
 
-    df = df[["assembly_accession", "ftp_path"]].dropna()
-    logging.info(f"Loaded {len(df)} assemblies from {file_path}")
-    return df
+    acc_idx = columns.index("assembly_accession")
+    ftp_idx = columns.index("ftp_path")
+    rows = []
+    with open(file_path, "r", newline="") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            # Check the accession before splitting the rest of the row
+            fields = line.split("\t", acc_idx + 1)
+            if len(fields) <= acc_idx or fields[acc_idx] not in wanted:
+                continue
+            row = line.rstrip("\r\n").split("\t")
+            if len(row) != len(columns) or row[ftp_idx] in NULL_VALUES:
+                continue
+            rows.append((row[acc_idx], row[ftp_idx]))
+    logging.info(f"Loaded {len(rows)} matching assemblies from {file_path}")
+    return rows
+
+# CHECKSUM FUNCTIONS
+def file_crc32(path):
+    """Return the size and CRC32 of a file on disk."""
+    size, crc = 0, 0
+    with open(path, "rb") as fh:
+        while chunk := fh.read(CHUNK_SIZE):
+            size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+    return size, crc
+
+def load_previous_summary(summary_path):
+    """Return {assembly_accession: record} from a previous run's summary file."""
+    if not summary_path.exists():
+        return {}
+    try:
+        table = pq.read_table(summary_path)
+    except (pa.ArrowInvalid, OSError) as e:
+        logging.warning(f"Could not read previous summary {summary_path}: {e}")
+        return {}
+    return {rec["assembly_accession"]: rec for rec in table.to_pylist()}
 
 # DOWNLOAD FUNCTION
-def download_with_wget(url, out_path):
-    """Download a file from URL using wget."""
+def gunzip_stream(chunks):
+    """
+    Yield decompressed data from an iterable of gzip bytes.
+    Concatenated gzip members are all decompressed and zero padding between or
+    after members is skipped, as gzip.open does.
+    Raises zlib.error if the stream ends in the middle of a member.
+    """
+    dec = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    member_open = True
+    for chunk in chunks:
+        while chunk:
+            if not member_open:
+                chunk = chunk.lstrip(b"\x00")
+                if not chunk:
+                    break
+                member_open = True
+            yield dec.decompress(chunk)
+            if not dec.eof:
+                break
+            # Member finished: continue with whatever follows it as a new member
+            chunk = dec.unused_data
+            dec = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            member_open = False
+    if member_open:
+        yield dec.flush()
+        if not dec.eof:
+            raise zlib.error("truncated gzip stream")
+
+def download_one(row):
+    """
+    Download a single genome using the shared HTTP session and return its status record.
+    The gzip stream is decompressed on the fly, so only the .fna file is written to disk.
+    Size and CRC32 of the written file are computed from the same stream and recorded
+    so later runs can verify the file before skipping it.
+    """
+    acc, asm_name, file_url, local_path = row
+    part_path = local_path.with_name(local_path.name + ".part")
+    size, crc = 0, 0
     try:
-        subprocess.run(["wget", "-q", "-O", str(out_path), url], check=True)
-        logging.info(f"Downloaded {url}")
-        return True
-    except subprocess.CalledProcessError as e:
-        logging.error(f"wget failed for {url}: {e}")
-        return False
+        with SESSION.get(file_url, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            with open(part_path, "wb") as fh:
+                for data in gunzip_stream(r.raw.stream(CHUNK_SIZE, decode_content=False)):
+                    size += len(data)
+                    crc = zlib.crc32(data, crc)
+                    fh.write(data)
+        # Only complete files ever appear under the final name
+        part_path.replace(local_path)
+        logging.info(f"Downloaded and decompressed {file_url}")
+        status = "Downloaded"
+    except (requests.RequestException, zlib.error, OSError) as e:
+        logging.error(f"Download failed for {file_url}: {e}")
+        part_path.unlink(missing_ok=True)
+        status = "Failed"
+        size, crc = None, None
+
+    return {
+        "assembly_accession": acc,
+        "asm_name": asm_name,
+        "ftp_url": file_url,
+        "local_file": str(local_path),
+        "status": status,
+        "size": size,
+        "crc32": crc
+    }
 
 # MAIN DOWNLOAD HANDLER
-def download_genomes(df, download_dir):
+def download_genomes(assemblies, download_dir, excel=False):
     """
-    Download genome FASTA files from the FTP paths provided in the dataframe.
-    Adds status information and saves a summary file.
+    Download genome FASTA files for the (assembly_accession, ftp_path) pairs provided.
+    Downloads run concurrently over a pooled HTTP session.
+    Adds status information and saves a Parquet summary file
+    (plus an .xlsx copy for manual inspection when `excel` is True).
+    Existing files are only skipped if their size and CRC32 match the previous summary.
     """
     download_dir = Path(download_dir)
     download_dir.mkdir(parents=True, exist_ok=True)
+    summary_path = download_dir / "download_summary_enter.parquet"
+    previous = load_previous_summary(summary_path)
+    expected = {
+        acc: (rec.get("size"), rec.get("crc32"))
+        for acc, rec in previous.items()
+        if rec.get("size") is not None and rec.get("crc32") is not None
+    }
 
     records = []
+    pending = []
 
-    for _, row in df.iterrows():
-        acc = row["assembly_accession"]
-        ftp_path = row["ftp_path"]
+    for acc, ftp_path in assemblies:
         asm_name = ftp_path.split("/")[-1]
 
-        file_url = f"{ftp_path}/{asm_name}_genomic.fna.gz"
-        local_fname = f"{acc}_{asm_name}_genomic.fna.gz"
+        # NCBI serves the same tree over HTTPS, which keeps connections reusable
+        file_url = f"{ftp_path.replace('ftp://', 'https://', 1)}/{asm_name}_genomic.fna.gz"
+        local_fname = f"{acc}_{asm_name}_genomic.fna"
         local_path = download_dir / local_fname
 
-        # Skip existing files
-        if local_path.exists() and local_path.stat().st_size > 0:
-            logging.info(f"⏭️ Skipping existing file: {local_fname}")
-            status = "Already exists"
+        # Skip existing files that match the size and checksum recorded last time
+        if (acc in expected and local_path.exists()
+                and local_path.stat().st_size == expected[acc][0]
+                and file_crc32(local_path) == expected[acc]):
+            logging.info(f"⏭️ Skipping verified existing file: {local_fname}")
+            records.append({
+                "assembly_accession": acc,
+                "asm_name": asm_name,
+                "ftp_url": file_url,
+                "local_file": str(local_path),
+                "status": "Already exists",
+                "size": expected[acc][0],
+                "crc32": expected[acc][1]
+            })
         else:
-            success = download_with_wget(file_url, local_path)
-            status = "Downloaded" if success else "Failed"
-
-        records.append({
-            "assembly_accession": acc,
-            "asm_name": asm_name,
-            "ftp_url": file_url,
-            "local_file": str(local_path),
-            "status": status
-        })
-
-    summary_df = pd.DataFrame(records)
-    summary_path = download_dir / "download_summary_enter.xlsx"
-    summary_df.to_excel(summary_path, index=False)
+            if local_path.exists():
+                logging.warning(f"Re-downloading unverified file: {local_fname}")
+            pending.append((acc, asm_name, file_url, local_path))
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        records.extend(pool.map(download_one, pending))
+
+    # Keep earlier records for accessions not in this run so their checksums are not lost
+    current = {rec["assembly_accession"] for rec in records}
+    carried = [rec for acc, rec in previous.items() if acc not in current]
+    summary_table = pa.Table.from_pylist(records + carried)
+    pq.write_table(summary_table, summary_path, compression="zstd")
     logging.info(f"📄 Download summary saved to {summary_path}")
-    return summary_df
-
-# UNZIP FUNCTION
-def unzip_gz_files(download_dir):
-    """Unzip all .gz files in the directory."""
-    for gz_file in Path(download_dir).glob("*.gz"):
-        unzipped = gz_file.with_suffix("")  # Removes .gz
-        with gzip.open(gz_file, "rb") as f_in:
-            with open(unzipped, "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        logging.info(f"🗜️ Unzipped {gz_file.name} -> {unzipped.name}")
+    if excel:
+        # pandas/openpyxl are only needed for the optional Excel copy
+        summary_table.to_pandas().to_excel(summary_path.with_suffix(".xlsx"), index=False)
+        logging.info(f"📄 Excel copy saved to {summary_path.with_suffix('.xlsx')}")
+    return records
+
+# COMMAND LINE
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Download selected genome FASTA files listed in assembly_summary_genbank.txt")
+    parser.add_argument("--summary", required=True, type=Path, help="Path to assembly_summary_genbank.txt")
+    parser.add_argument("--out", required=True, type=Path, help="Directory to download genomes into")
+    parser.add_argument("--accessions", required=True, type=Path, help="Text file of assembly accessions, one per line")
+    parser.add_argument("--excel", action="store_true", help="Also write the download summary as .xlsx")
+    return parser.parse_args()
 
 # MAIN SCRIPT
 def main():
-    assembly_summary_path = Path("INSERT PATH/assembly_summary_genbank.txt")
-    download_dir = Path("INSERT PATH")
-
-    # Load assembly summary file
-    assembly_df = load_assembly_summary(assembly_summary_path)
+    args = parse_args()
 
     # FILTER SPECIFIC ACCESSIONS
-    accessions = [
-    "INSERT LIST,"
-    ]
+    accessions = frozenset(args.accessions.read_text().split())
 
-    assembly_df = assembly_df[assembly_df["assembly_accession"].isin(accessions)]
+    # Load assembly summary file, keeping only the selected accessions
+    assemblies = load_assembly_summary(args.summary, wanted=accessions)
 
-    logging.info(f"Filtered to {len(assembly_df)} selected assemblies")
+    logging.info(f"Filtered to {len(assemblies)} selected assemblies")
 
-    # ------------------ DOWNLOAD & UNZIP ------------------
+    # ------------------ DOWNLOAD & DECOMPRESS ------------------
     logging.info("🚀 Starting genome download...")
-    download_genomes(assembly_df, download_dir)
-    unzip_gz_files(download_dir)
-    logging.info("All genomes downloaded and unzipped successfully!")
+    download_genomes(assemblies, args.out, excel=args.excel)
+    logging.info("All genomes downloaded and decompressed successfully!")
 
 if __name__ == "__main__":
     main()